@@ -14,7 +14,8 @@ from qhoptim.pyt import QHAdam
 from .metrics import calculate_roc_auc
 from models import (get_gradient, 
                     get_noise, 
-                    gradient_penalty)
+                    gradient_penalty,
+                    unwrap_model)
 from models import (create_node_model, 
                     create_fcn_model)
 
@@ -65,8 +66,8 @@ class CramerGAN:
     def save_models(self, path, epoch):
         torch.save({
             'epoch': epoch,
-            'generator_model_state_dict': self.generator_model.state_dict(),
-            'critic_model_state_dict': self.critic_model.state_dict(),
+            'generator_model_state_dict': unwrap_model(self.generator_model).state_dict(),
+            'critic_model_state_dict': unwrap_model(self.critic_model).state_dict(),
             }, path)
 
     def cramer_critic(self, left, right):
@@ -75,8 +76,8 @@ class CramerGAN:
 
     def load_models(self, path):
         checkpoint = torch.load(path)
-        self.generator_model.load_state_dict(checkpoint['generator_model_state_dict'])
-        self.critic_model.load_state_dict(checkpoint['critic_model_state_dict'])
+        unwrap_model(self.generator_model).load_state_dict(checkpoint['generator_model_state_dict'])
+        unwrap_model(self.critic_model).load_state_dict(checkpoint['critic_model_state_dict'])
         return checkpoint
 
     def create_generator(self):
@@ -135,9 +136,9 @@ class CramerGAN:
         else:
             x, dlls, weight = batch
 
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
+        x = x.to(self.params["device"])
+        dlls = dlls.to(self.params["device"])
+        weight = weight.to(self.params["device"])
         
         noized_x_first = torch.cat(
             [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
@@ -165,9 +166,9 @@ class CramerGAN:
             x, dlls = batch
         else:
             x, dlls, weight = batch
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
+        x = x.to(self.params["device"])
+        dlls = dlls.to(self.params["device"])
+        weight = weight.to(self.params["device"])
 
         noized_x_first = torch.cat(
             [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
@@ -180,15 +181,17 @@ class CramerGAN:
         )
 
         real_full = torch.cat([dlls, x], dim=1)
-        generated_first = torch.cat([self.generator_model(noized_x_first), x], dim=1)
-        generated_second = torch.cat([self.generator_model(noized_x_second), x], dim=1)
+        # the critic loss must not backpropagate into the generator
+        with torch.no_grad():
+            generated_first = torch.cat([self.generator_model(noized_x_first), x], dim=1)
+            generated_second = torch.cat([self.generator_model(noized_x_second), x], dim=1)
         
         critic_loss = torch.mean(self.cramer_critic(real_full, generated_second) * weight - 
                                     self.cramer_critic(generated_first, generated_second) * weight)
 
         epsilon = torch.rand(real_full.size(0), 1, device=self.params["device"], requires_grad=True)
-        gradient = get_gradient(self.critic_model, real_full, generated_first.detach(), 
-                                generated_second.detach(), epsilon=epsilon)
+        gradient = get_gradient(self.critic_model, real_full, generated_first, 
+                                generated_second, epsilon=epsilon)
         gp = gradient_penalty(gradient)
 
         critic_loss = self.params['c_lambda'] * gp - critic_loss
@@ -261,7 +264,7 @@ class CramerGAN:
                 weight = torch.zeros((dlls.size(0), 1))
             else:
                 x, dlls, weight = batch
-            x = x.to(self.params["device"]).type(torch.float)
+            x = x.to(self.params["device"])
 
             generated = self.generate(x)
             generated_list.append(generated)
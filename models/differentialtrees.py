@@ -2,9 +2,17 @@ import torch
 import torch.nn as nn
 import typing as tp
 
+from torch.utils.checkpoint import checkpoint
+
 from .node import lib
 
 
+def _run_block(block, x, use_checkpoint=False):
+    if use_checkpoint:
+        return checkpoint(block, x, use_reentrant=False)
+    return block(x)
+
+
 class ClassificationDifferentialTree(nn.Module):
     """
     Ensemble of Differential Tree for Classification task
@@ -13,10 +21,18 @@ class ClassificationDifferentialTree(nn.Module):
     :param num_layers: number of layers
     :param tree_dim: number of response channels in the response of individual tree(number of class)
     :param depth: number of splits in every tree
+    :param use_checkpoint: recompute tree activations during backward instead of storing them
     """
 
     def __init__(
-        self, input_size=8, layer_dim=128, num_layers=2, tree_dim=2, depth=6, **kwargs
+        self,
+        input_size=8,
+        layer_dim=128,
+        num_layers=2,
+        tree_dim=2,
+        depth=6,
+        use_checkpoint=False,
+        **kwargs
     ):
         super(ClassificationDifferentialTree, self).__init__()
         self.input_size = input_size
@@ -24,6 +40,7 @@ class ClassificationDifferentialTree(nn.Module):
         self.num_layers = num_layers
         self.tree_dim = tree_dim
         self.depth = depth
+        self.use_checkpoint = use_checkpoint
 
         self.layers = self._get_clf_tree_block(
             input_size, layer_dim, num_layers, tree_dim, depth
@@ -47,7 +64,7 @@ class ClassificationDifferentialTree(nn.Module):
         )
 
     def forward(self, x, noise=None):
-        return self.layers(x)
+        return _run_block(self.layers, x, self.use_checkpoint and self.training)
 
 
 class RegressionDifferentialTree(nn.Module):
@@ -58,10 +75,18 @@ class RegressionDifferentialTree(nn.Module):
     :param num_layers: number of layers
     :param tree_dim: number of response channels in the response of individual tree(number of class)
     :param depth: number of splits in every tree
+    :param use_checkpoint: recompute tree activations during backward instead of storing them
     """
 
     def __init__(
-        self, input_size=8, layer_dim=128, num_layers=2, tree_dim=2, depth=6, **kwargs
+        self,
+        input_size=8,
+        layer_dim=128,
+        num_layers=2,
+        tree_dim=2,
+        depth=6,
+        use_checkpoint=False,
+        **kwargs
     ):
         super(RegressionDifferentialTree, self).__init__()
         self.input_size = input_size
@@ -69,6 +94,7 @@ class RegressionDifferentialTree(nn.Module):
         self.num_layers = num_layers
         self.tree_dim = tree_dim
         self.depth = depth
+        self.use_checkpoint = use_checkpoint
 
         self.dlle = self._get_reg_tree_block(
             input_size, layer_dim, num_layers, tree_dim, depth
@@ -104,24 +130,29 @@ class RegressionDifferentialTree(nn.Module):
         )
 
     def forward(self, x, noise=None):
+        use_checkpoint = self.use_checkpoint and self.training
         result = torch.cat(
             [
-                self.dlle(x).unsqueeze(1),
-                self.dllk(x).unsqueeze(1),
-                self.dllmu(x).unsqueeze(1),
-                self.dllp(x).unsqueeze(1),
-                self.dllbt(x).unsqueeze(1),
+                _run_block(self.dlle, x, use_checkpoint).unsqueeze(1),
+                _run_block(self.dllk, x, use_checkpoint).unsqueeze(1),
+                _run_block(self.dllmu, x, use_checkpoint).unsqueeze(1),
+                _run_block(self.dllp, x, use_checkpoint).unsqueeze(1),
+                _run_block(self.dllbt, x, use_checkpoint).unsqueeze(1),
             ],
             axis=1,
         )
         return result
 
 
-def create_node_model(config: tp.Dict[str, tp.Any], model_type: str = "classification"):
+def create_node_model(
+    config: tp.Dict[str, tp.Any],
+    model_type: str = "classification",
+    use_checkpoint: bool = False,
+):
     if model_type == "classification":
-        model = ClassificationDifferentialTree(**config)
+        model = ClassificationDifferentialTree(**config, use_checkpoint=use_checkpoint)
     elif model_type == "regression":
-        model = RegressionDifferentialTree(**config)
+        model = RegressionDifferentialTree(**config, use_checkpoint=use_checkpoint)
     else:
         raise NameError("Unknown model type: {}".format(model_type))
     return model
\ No newline at end of file
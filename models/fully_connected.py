@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 import typing as tp
 
+from torch.utils.checkpoint import checkpoint
+
 
 class Fully_connected(nn.Module):
     """
@@ -9,16 +11,23 @@ class Fully_connected(nn.Module):
     :param input_size: size of input tensor
     :param hidden_channel: hidden tensor
     :param out_channel: size of output tensor
+    :param use_checkpoint: recompute block activations during backward instead of storing them
     :return: tensor
     """
 
     def __init__(
-        self, input_size: int = 1, hidden_channel: int = 64, out_channel: int = 1, **kwargs
+        self,
+        input_size: int = 1,
+        hidden_channel: int = 64,
+        out_channel: int = 1,
+        use_checkpoint: bool = False,
+        **kwargs
     ):
         super(Fully_connected, self).__init__()
         self.input_size = input_size
         self.hidden_channel = hidden_channel
         self.out_channel = out_channel
+        self.use_checkpoint = use_checkpoint
 
         self.crit = nn.Sequential(
             self._make_crit_block(self.input_size, self.hidden_channel),
@@ -47,14 +56,20 @@ class Fully_connected(nn.Module):
             )
 
     def forward(self, image):
-        crit_pred = self.crit(image)
+        if self.use_checkpoint and self.training:
+            crit_pred = image
+            for block in self.crit:
+                crit_pred = checkpoint(block, crit_pred, use_reentrant=False)
+        else:
+            crit_pred = self.crit(image)
         return crit_pred.view(len(crit_pred), -1)
 
-def create_fcn_model(config: tp.Dict[str, tp.Any], model_type: str='classification'):
+def create_fcn_model(config: tp.Dict[str, tp.Any], model_type: str='classification',
+                     use_checkpoint: bool = False):
     if model_type == 'classification':
-        model = Fully_connected(**config)
+        model = Fully_connected(**config, use_checkpoint=use_checkpoint)
     elif model_type == 'regression':
-        model = Fully_connected(**config)
+        model = Fully_connected(**config, use_checkpoint=use_checkpoint)
     else:
         raise NameError(
             "Unknown model type: {}".format(model_type)
@@ -11,7 +11,7 @@ from catboost import CatBoostClassifier
 from qhoptim.pyt import QHAdam
 
 from .metrics import calculate_roc_auc
-from models import get_noise
+from models import get_noise, unwrap_model
 from models import (create_node_model, 
                     create_fcn_model)
 
@@ -61,14 +61,14 @@ class JSGAN():
     def save_models(self, path, epoch):
         torch.save({
             'epoch': epoch,
-            'generator_model_state_dict': self.generator_model.state_dict(),
-            'critic_model_state_dict': self.critic_model.state_dict(),
+            'generator_model_state_dict': unwrap_model(self.generator_model).state_dict(),
+            'critic_model_state_dict': unwrap_model(self.critic_model).state_dict(),
             }, path)
 
     def load_models(self, path):
         checkpoint = torch.load(path)
-        self.generator_model.load_state_dict(checkpoint['generator_model_state_dict'])
-        self.critic_model.load_state_dict(checkpoint['critic_model_state_dict'])
+        unwrap_model(self.generator_model).load_state_dict(checkpoint['generator_model_state_dict'])
+        unwrap_model(self.critic_model).load_state_dict(checkpoint['critic_model_state_dict'])
         return checkpoint
 
     def create_generator(self):
@@ -123,9 +123,9 @@ class JSGAN():
         else:
             x, dlls, weight = batch
 
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
+        x = x.to(self.params["device"])
+        dlls = dlls.to(self.params["device"])
+        weight = weight.to(self.params["device"])
 
         noized_x = torch.cat(
             [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
@@ -149,9 +149,9 @@ class JSGAN():
         else:
             x, dlls, weight = batch
 
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
+        x = x.to(self.params["device"])
+        dlls = dlls.to(self.params["device"])
+        weight = weight.to(self.params["device"])
 
         noized_x = torch.cat(
             [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
@@ -238,7 +238,7 @@ class JSGAN():
                 weight = torch.zeros((dlls.size(0), 1))
             else:
                 x, dlls, weight = batch
-            x = x.to(self.params["device"]).type(torch.float)
+            x = x.to(self.params["device"])
 
             generated = self.generate(x)
             generated_list.append(generated)
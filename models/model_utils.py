@@ -5,6 +5,32 @@ def get_noise(batch_size, latent_dim, mean=0, std=1):
     return torch.zeros(batch_size, latent_dim).normal_(mean, std)
 
 
+def unwrap_model(model):
+    """
+    Return the original module of a model wrapped by DistributedDataParallel and/or torch.compile.
+    Parameters:
+        model: a plain, compiled or distributed module
+    Returns:
+        module: the module owning the parameters, with unprefixed state_dict keys
+    """
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        model = model.module
+    return getattr(model, "_orig_mod", model)
+
+
+def trainable_parameters(model):
+    """
+    Return the parameters of a model that are optimized.
+    The NODE layers register their initialization flag as a uint8 parameter with
+    requires_grad=False, which fused and capturable Adam reject.
+    Parameters:
+        model: a module
+    Returns:
+        parameters: list of the parameters that require grad
+    """
+    return [parameter for parameter in model.parameters() if parameter.requires_grad]
+
+
 def gradient_penalty(gradient):
     """
     Return the gradient penalty, given a gradient.
@@ -15,8 +41,8 @@ def gradient_penalty(gradient):
     Returns:
         penalty: the gradient penalty
     """
-    gradient = gradient.view(len(gradient), -1)
-    gradient_norm = gradient.norm(2, dim=1)
+    # reduce in float32, the gradient may come from a bfloat16 autocast region
+    gradient_norm = torch.linalg.vector_norm(gradient.flatten(1).float(), ord=2, dim=1)
     penalty = torch.mean((gradient_norm - 1) ** 2)
     return penalty
 
@@ -28,11 +54,14 @@ def get_gradient(crit, real, fake, fake2=None, epsilon=None):
         crit: the critic model
         real: a batch of real images
         fake: a batch of fake images
-        epsilon: a vector of the uniformly random proportions of real/fake per mixed image
+        epsilon: a vector of the uniformly random proportions of real/fake per mixed image,
+            of shape (batch_size, 1) so that it broadcasts over the features
     Returns:
         gradient: the gradient of the critic's scores, with respect to the mixed image
     """
     mixed_images = real * epsilon + fake * (1 - epsilon)
+    if not mixed_images.requires_grad:
+        mixed_images.requires_grad_()
     if fake2 is not None:
         mixed_scores = crit(mixed_images, fake2)
     else:
@@ -42,6 +71,5 @@ def get_gradient(crit, real, fake, fake2=None, epsilon=None):
         outputs=mixed_scores,
         grad_outputs=torch.ones_like(mixed_scores),
         create_graph=True,
-        retain_graph=True,
     )[0]
     return gradient
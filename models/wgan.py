@@ -2,10 +2,10 @@ import torch
 import logging
 import typing as tp
 import numpy as np
-import seaborn as sns
 import matplotlib.pyplot as plt
 import torch.nn.functional as F
 
+from functools import lru_cache
 from torchvision.utils import make_grid
 from sklearn.model_selection import train_test_split
 from catboost import CatBoostClassifier
@@ -13,27 +13,43 @@ from qhoptim.pyt import QHAdam
 
 from .metrics import calculate_roc_auc
 from models import (get_gradient, 
-                    get_noise, 
-                    gradient_penalty)
+                    gradient_penalty,
+                    trainable_parameters,
+                    unwrap_model)
 from models import (create_node_model, 
                     create_fcn_model)
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _histogram_figure(num_of_subplots):
+    fig, axes = plt.subplots(num_of_subplots, 1, figsize=(10, 16), squeeze=False)
+    fig.suptitle("Histograms")
+    return fig, axes.flatten()
+
+
 class WGAN:
     def __init__(self, config: tp.Dict[str, tp.Any]):
         self.params = config
+        self._cached_batch = None
+        self._cached_inputs = None
+        self._noise_generator = torch.Generator(device=self.params["device"])
+        # every distributed process draws its own noise
+        rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+        self._noise_generator.manual_seed(self.params["seed"] + rank)
+        self._buffers = {}
         self.create_generator()
         self.create_critic()
 
     def configure_optimizers(self):
         if self.params["generator"]["optimizer"] == "adam":
             generator_optimizer = torch.optim.Adam(
-                self.generator_model.parameters(),
+                trainable_parameters(self.generator_model),
                 lr=self.params['generator']['learning_rate'],
                 weight_decay=self.params['generator']['weight_decay'],
-                betas=(self.params["generator"]["beta1"], self.params["generator"]["beta2"])
+                betas=(self.params["generator"]["beta1"], self.params["generator"]["beta2"]),
+                fused=str(self.params["device"]).startswith("cuda"),
             )
         elif self.params["generator"]["optimizer"] == "qhadam":
             generator_optimizer = QHAdam(
@@ -46,10 +62,12 @@ class WGAN:
 
         if self.params["critic"]["optimizer"] == "adam":
             critic_optimizer = torch.optim.Adam(
-                self.critic_model.parameters(),
+                trainable_parameters(self.critic_model),
                 lr=self.params['critic']['learning_rate'],
                 weight_decay=self.params['critic']['weight_decay'],
-                betas=(self.params["critic"]["beta1"], self.params["critic"]["beta2"])
+                betas=(self.params["critic"]["beta1"], self.params["critic"]["beta2"]),
+                capturable=self.params["use_cuda_graph"] and str(self.params["device"]).startswith("cuda"),
+                fused=str(self.params["device"]).startswith("cuda"),
             )
         elif self.params["critic"]["optimizer"] == "qhadam":
             critic_optimizer = QHAdam(
@@ -65,14 +83,14 @@ class WGAN:
     def save_models(self, path, epoch):
         torch.save({
             'epoch': epoch,
-            'generator_model_state_dict': self.generator_model.state_dict(),
-            'critic_model_state_dict': self.critic_model.state_dict(),
+            'generator_model_state_dict': unwrap_model(self.generator_model).state_dict(),
+            'critic_model_state_dict': unwrap_model(self.critic_model).state_dict(),
             }, path)
 
     def load_models(self, path):
         checkpoint = torch.load(path)
-        self.generator_model.load_state_dict(checkpoint['generator_model_state_dict'])
-        self.critic_model.load_state_dict(checkpoint['critic_model_state_dict'])
+        unwrap_model(self.generator_model).load_state_dict(checkpoint['generator_model_state_dict'])
+        unwrap_model(self.critic_model).load_state_dict(checkpoint['critic_model_state_dict'])
         return checkpoint
 
     def create_generator(self):
@@ -80,12 +98,14 @@ class WGAN:
             logger.info("Creating NODE model")
             logger.info(f"params: \n{self.params['generator']}")
             self.generator_model = create_node_model(self.params['generator']['params'], 
-                                    model_type=self.params['generator_model_type'])
+                                    model_type=self.params['generator_model_type'],
+                                    use_checkpoint=self.params['use_checkpoint'])
         elif self.params["critic_architecture"].lower() == "fcn":
             logger.info("Creating FCN model")
             logger.info(f"params: \n{self.params['generator']}")
             self.generator_model = create_fcn_model(self.params['generator']['params'], 
-                                    model_type=self.params['generator_model_type'])
+                                    model_type=self.params['generator_model_type'],
+                                    use_checkpoint=self.params['use_checkpoint'])
         else:
             raise NameError(
                 "Unknown generator architecture: {}".format(
@@ -100,6 +120,14 @@ class WGAN:
 
         self.generator_model.to(self.params["device"])
 
+        if not self.params["disable_compile"]:
+            # The critic is left eager: the gradient penalty needs a double backward,
+            # which compiled graphs do not support.
+            logger.info("Compiling generator model")
+            self.generator_model = torch.compile(
+                self.generator_model, mode="reduce-overhead", fullgraph=False
+            )
+
     def create_critic(self):
         if self.params["critic_architecture"].lower() == "node":
             logger.info("Creating NODE model")
@@ -125,20 +153,63 @@ class WGAN:
 
         self.critic_model.to(self.params["device"])
 
+    def _get_buffer(self, name, batch_size, width):
+        """
+        Return the first batch_size rows of a preallocated device buffer.
+        The buffer is reused between calls and only reallocated when it is too small,
+        so the returned tensor is overwritten by the next call with the same name.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size(0) < batch_size or buffer.size(1) != width:
+            buffer = torch.empty(
+                max(batch_size, self.params["batch_size"]), width, device=self.params["device"]
+            )
+            self._buffers[name] = buffer
+        return buffer[:batch_size]
+
+    def _fill_noized_x(self, x, name="noized_x"):
+        x_dim = x.size(1)
+        noized_x = self._get_buffer(name, x.size(0), x_dim + self.params["noise_dim"])
+        noized_x[:, :x_dim].copy_(x)
+        noized_x[:, x_dim:].normal_(generator=self._noise_generator)
+        return noized_x
+
+    def _fill_real_full(self, x, dlls):
+        # real samples live in the second half of the critic input buffer, the
+        # first half is filled with the generated samples by train_critic
+        critic_input = self._get_buffer("critic_input", 2 * x.size(0), dlls.size(1) + x.size(1))
+        real_full = critic_input[x.size(0):]
+        real_full[:, :dlls.size(1)].copy_(dlls)
+        real_full[:, dlls.size(1):].copy_(x)
+        return real_full
+
+    def _build_inputs(self, batch):
+        """
+        Build the generator and critic inputs for a batch already moved to the device.
+        The result is cached per batch, so the critic steps and the generator step
+        of one iteration share the same noise and concatenations.
+        Returns:
+            noized_x: conditions concatenated with noise, input of the generator
+            real_full: real dlls concatenated with conditions, input of the critic
+        """
+        if batch is self._cached_batch:
+            return self._cached_inputs
+
+        x, dlls = batch[0], batch[1]
+        noized_x = self._fill_noized_x(x)
+        real_full = self._fill_real_full(x, dlls)
+
+        self._cached_batch = batch
+        self._cached_inputs = (noized_x, real_full)
+        return self._cached_inputs
+
     def train_generator(self, batch):
         if self.params['data']['drop_weights']:
             x, dlls = batch
         else:
             x, dlls, weight = batch
 
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
-        
-        noized_x = torch.cat(
-            [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
-            dim=1,
-        )
+        noized_x, _ = self._build_inputs(batch)
 
         generated = torch.cat([self.generator_model(noized_x), x], dim=1)
         crit_fake_pred = self.critic_model(generated)
@@ -149,28 +220,33 @@ class WGAN:
 
         return generator_result
 
-    def train_critic(self, batch):
+    def train_critic(self, batch, generated_detached=None):
         if self.params['data']['drop_weights']:
             x, dlls = batch
         else:
             x, dlls, weight = batch
-        x = x.to(self.params["device"]).type(torch.float)
-        dlls = dlls.to(self.params["device"]).type(torch.float)
-        weight = weight.to(self.params["device"]).type(torch.float)
 
-        noized_x = torch.cat(
-            [x, get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])],
-            dim=1,
-        )
+        if generated_detached is None:
+            noized_x, real_full = self._build_inputs(batch)
+            with torch.no_grad():
+                generated_detached = self.generator_model(noized_x)
+        elif batch is self._cached_batch:
+            _, real_full = self._cached_inputs
+        else:
+            # e.g. the static inputs of a captured CUDA graph: the critic only
+            # needs real_full, so no noise is drawn and the cache is left alone
+            real_full = self._fill_real_full(x, dlls)
 
-        real_full = torch.cat([dlls, x], dim=1)
-        generated = torch.cat([self.generator_model(noized_x), x], dim=1)
+        critic_input = self._get_buffer("critic_input", 2 * x.size(0), real_full.size(1))
+        generated = critic_input[:x.size(0)]
+        generated[:, :generated_detached.size(1)].copy_(generated_detached)
+        generated[:, generated_detached.size(1):].copy_(x)
 
-        crit_fake_pred = self.critic_model(generated.detach())
-        crit_real_pred = self.critic_model(real_full)
+        # one critic forward over [generated; real_full]
+        crit_fake_pred, crit_real_pred = self.critic_model(critic_input).split(x.size(0), dim=0)
 
-        epsilon = torch.rand(real_full.size(0), 1, device=self.params["device"], requires_grad=True)
-        gradient = get_gradient(self.critic_model, real_full, generated.detach(), epsilon=epsilon)
+        epsilon = torch.rand(real_full.size(0), 1, device=real_full.device, dtype=real_full.dtype)
+        gradient = get_gradient(self.critic_model, real_full, generated, epsilon=epsilon)
         gp = gradient_penalty(gradient)
         critic_loss = torch.mean((crit_fake_pred - crit_real_pred) * weight) + self.params['c_lambda'] * gp
 
@@ -183,47 +259,35 @@ class WGAN:
 
     @torch.no_grad()
     def generate(self, x):
-        noize = get_noise(x.shape[0], self.params['noise_dim']).to(self.params["device"])
-        noized_x = torch.cat(
-            [x, noize],
-            dim=1,
-        )
-        generated = self.generator_model(noized_x)
+        noized_x = self._fill_noized_x(x, name="generate_noized_x")
+        # reduce-overhead compilation replays CUDA graphs whose outputs are
+        # overwritten by the next call, so keep a copy of every batch
+        generated = self.generator_model(noized_x).clone()
         return generated
 
     def get_histograms(self, generated, real):
         features_names = self.params["features_names"]
-        num_of_subplots = len(features_names)
-        
-        plt.clf()
-        fig, axes = plt.subplots(num_of_subplots, 1, figsize=(10, 16))
-        plt.suptitle("Histograms")
+        fig, axes = _histogram_figure(len(features_names))
+
+        generated_np = generated.detach().cpu().numpy()
+        real_np = real if isinstance(real, np.ndarray) else real.cpu().numpy()
 
         for feature_index, (feature_name, ax) in enumerate(
-            zip(features_names, axes.flatten())
+            zip(features_names, axes)
         ):
+            ax.cla()
             ax.set_title(feature_name)
 
-            sns.distplot(
-                real[:, feature_index],
-                bins=100,
-                label="real",
-                color="b",
-                hist_kws={"alpha": 1.0},
-                ax=ax,
-                norm_hist=True,
-                kde=False,
+            real_counts, real_edges = np.histogram(
+                real_np[:, feature_index], bins=100, density=True
             )
+            ax.stairs(real_counts, real_edges, label="real", color="b", fill=True, alpha=1.0)
 
-            sns.distplot(
-                generated[:, feature_index].cpu(),
-                bins=100,
-                label="generated",
-                color="r",
-                hist_kws={"alpha": 0.5},
-                ax=ax,
-                norm_hist=True,
-                kde=False,
+            generated_counts, generated_edges = np.histogram(
+                generated_np[:, feature_index], bins=100, density=True
+            )
+            ax.stairs(
+                generated_counts, generated_edges, label="generated", color="r", fill=True, alpha=0.5
             )
 
             if feature_index == 0:
@@ -242,7 +306,7 @@ class WGAN:
                 weight = torch.zeros((dlls.size(0), 1))
             else:
                 x, dlls, weight = batch
-            x = x.to(self.params["device"]).type(torch.float)
+            x = x.to(self.params["device"])
 
             generated = self.generate(x)
             generated_list.append(generated)
@@ -6,29 +6,47 @@ import neptune
 
 from omegaconf import DictConfig, OmegaConf
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 
 from models import WGAN, JSGAN, CramerGAN
-from trainer import Trainer
-from utils import get_RICH
+from trainer import Trainer, get_rank, setup_distributed
+from utils import get_RICH, float32_collate
 
 logger = logging.getLogger(__name__)
 
 
 @hydra.main(config_path="config", config_name="config")
 def main(config: DictConfig):
-
-    logger.info("Setting up logger")
-    project = neptune.init(
-        project_qualified_name=config["neptune"]["project_name"],
-        api_token="",
+    # Let the CUDA caching allocator grow existing segments instead of allocating
+    # new ones when the batch size changes (e.g. the last batch of an epoch).
+    # The variable is read when the allocator initializes, so it applies as long
+    # as it is set before the first CUDA allocation. Requires torch >= 2.1.
+    os.environ.setdefault(
+        "PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:512"
     )
 
-    logger.info("Setting up experiment")
-    neptune_logger = project.create_experiment(
-        name=config["neptune"]["experiment_name"],
-        tags=OmegaConf.to_container(config["neptune"]["tags"]),
-        params=OmegaConf.to_container(config),
-    )
+    local_rank = setup_distributed()
+    if local_rank is not None:
+        logger.info(f"Running distributed training on cuda:{local_rank}")
+        config["device"] = f"cuda:{local_rank}"
+
+    # only the main process logs and writes to disk
+    is_main_process = get_rank() == 0
+
+    neptune_logger = None
+    if is_main_process:
+        logger.info("Setting up logger")
+        project = neptune.init(
+            project_qualified_name=config["neptune"]["project_name"],
+            api_token="",
+        )
+
+        logger.info("Setting up experiment")
+        neptune_logger = project.create_experiment(
+            name=config["neptune"]["experiment_name"],
+            tags=OmegaConf.to_container(config["neptune"]["tags"]),
+            params=OmegaConf.to_container(config),
+        )
 
     logger.info("Getting dataset")
     input_size, dll_shape, train_dataset, valid_dataset, scaler = get_RICH(
@@ -38,12 +56,16 @@ def main(config: DictConfig):
     )
 
     logger.info("Creating train dataloader")
+    train_sampler = DistributedSampler(train_dataset) if local_rank is not None else None
     train_loader = DataLoader(
         dataset=train_dataset,
         batch_size=config["batch_size"],
         num_workers=config["num_workers"],
-        shuffle=True,
+        shuffle=train_sampler is None,
+        sampler=train_sampler,
         pin_memory=True,
+        collate_fn=float32_collate,
+        persistent_workers=config["num_workers"] > 0,
     )
 
     logger.info("Creating validation dataloader")
@@ -53,6 +75,8 @@ def main(config: DictConfig):
         num_workers=config["num_workers"],
         shuffle=True,
         pin_memory=True,
+        collate_fn=float32_collate,
+        persistent_workers=config["num_workers"] > 0,
     )
 
     logger.info("Creating GAN model")
@@ -67,8 +91,8 @@ def main(config: DictConfig):
 
     save_path = config["save_path"]
     folder_name = f"{config['gan_type']}_{config['generator_architecture']}_{config['critic_architecture']}_{config['experiment_data']}"
-    if not os.path.exists(folder_name):
-        os.mkdir(folder_name)
+    if is_main_process:
+        os.makedirs(folder_name, exist_ok=True)
     save_path = os.path.join(save_path, folder_name)
 
     logger.info("Creating trainer")
@@ -81,6 +105,8 @@ def main(config: DictConfig):
         save_path=save_path,
         freeze_generator=config["freeze_generator"],
         neptune_logger=neptune_logger,
+        use_cuda_graph=config["use_cuda_graph"],
+        mixed_precision=config["mixed_precision"],
     )
     logger.info("Calculating inference time")
     trainer.calculate_inference_time(
@@ -1,4 +1,5 @@
 import os
+import contextlib
 import torch
 import logging
 import numpy as np
@@ -7,11 +8,39 @@ import matplotlib.pyplot as plt
 from tqdm import tqdm
 from typing import Callable, Any, List
 from torch.nn import functional as F
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from models import unwrap_model
 
 logger = logging.getLogger(__name__)
 
 
+def setup_distributed():
+    """
+    Initialize the NCCL process group when the script is launched on several processes
+    (e.g. with torchrun) and bind the process to its local GPU.
+    Must be called before the models are created.
+    Returns:
+        local_rank: index of the local GPU, or None for a single process run
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return None
+    local_rank = int(os.environ["LOCAL_RANK"])
+    torch.cuda.set_device(local_rank)
+    torch.distributed.init_process_group("nccl")
+    return local_rank
+
+
+def is_distributed():
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def get_rank():
+    return torch.distributed.get_rank() if is_distributed() else 0
+
+
 class Trainer:
     def __init__(
         self,
@@ -23,6 +52,8 @@ class Trainer:
         save_path: str = ".",
         freeze_generator: bool = False,
         neptune_logger: Callable = None,
+        use_cuda_graph: bool = False,
+        mixed_precision: bool = False,
     ):
         self.gan_model = gan_model
         self.max_epoch = max_epoch
@@ -32,10 +63,64 @@ class Trainer:
         self.save_path = save_path
         self.freeze_generator = freeze_generator
         self.neptune_logger = neptune_logger
+        # bfloat16 autocast raises on CUDA devices without bfloat16 support (pre-Ampere)
+        self.mixed_precision = mixed_precision and (
+            not str(device).startswith("cuda") or torch.cuda.is_bf16_supported()
+        )
+        if mixed_precision and not self.mixed_precision:
+            logger.warning("bfloat16 is not supported by this CUDA device, mixed precision is disabled")
+        self.distributed = is_distributed()
+        self.is_main_process = get_rank() == 0
+        # DDP broadcasts rank 0's weights only when wrapping, before the NODE layers
+        # run their data-aware initialization on the first (per rank) forward pass
+        self._parameters_synchronized = not self.distributed
+        if self.distributed:
+            # DDP has to see the eager module: a compiled generator would be traced
+            # without the gradient hooks, so compilation is skipped when distributed
+            gan_model.generator_model = self._wrap_ddp(unwrap_model(gan_model.generator_model))
+            gan_model.critic_model = self._wrap_ddp(gan_model.critic_model)
         (
             self.generator_optimizer,
             self.critic_optimizer,
         ) = gan_model.configure_optimizers()
+        # the critic update is replayed from a CUDA graph only for models that
+        # cache their inputs per batch and with an optimizer that supports capture
+        self.use_cuda_graph = (
+            use_cuda_graph
+            and not self.distributed
+            and str(device).startswith("cuda")
+            and hasattr(gan_model, "_build_inputs")
+            and self.critic_optimizer.defaults.get("capturable", False)
+        )
+        self._critic_graph = None
+        self._static_batch = None
+        self._static_generated = None
+        self._static_critic_losses = None
+        self._metric_sums = {}
+        self._metric_counts = {}
+
+    @staticmethod
+    def _wrap_ddp(model):
+        # the models hold no running statistics, and without buffer broadcasts the
+        # main process can run validation forwards alone
+        return DistributedDataParallel(
+            model,
+            device_ids=[torch.cuda.current_device()],
+            broadcast_buffers=False,
+            bucket_cap_mb=25,
+            gradient_as_bucket_view=True,
+        )
+
+    def _broadcast_parameters(self):
+        """
+        Copy the parameters and buffers of rank 0 to every process.
+        DDP only averages gradients, so replicas that diverged (e.g. after a
+        data-aware initialization on different shards) would otherwise stay different.
+        """
+        for model in (self.gan_model.generator_model, self.gan_model.critic_model):
+            module = unwrap_model(model)
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                torch.distributed.broadcast(tensor.data, src=0)
 
     def calculate_inference_time(self, dummy_shape, repetitions):
         dummy_input = torch.randn(*dummy_shape, dtype=torch.float).to(self.device)
@@ -43,51 +128,183 @@ class Trainer:
         starter, ender = torch.cuda.Event(enable_timing=True), torch.cuda.Event(
             enable_timing=True
         )
-        timings = np.zeros((repetitions, 1))
-        # GPU-WARM-UP
-        for _ in range(10):
-            _ = self.gan_model.generator_model(dummy_input)
+        # running mean and sum of squared deviations (Welford)
+        count, mean_syn, m2 = 0, 0.0, 0.0
+        # the eager module is captured, a compiled one manages its own CUDA graphs
+        generator_model = unwrap_model(self.gan_model.generator_model)
         with torch.no_grad():
-            for rep in range(repetitions):
+            # GPU-WARM-UP on a side stream, as required before graph capture
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(10):
+                    _ = generator_model(dummy_input)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                _ = generator_model(dummy_input)
+
+            for _ in range(repetitions):
                 starter.record()
-                _ = self.gan_model.generator_model(dummy_input)
+                graph.replay()
                 ender.record()
-                # WAIT FOR GPU SYNC
-                torch.cuda.synchronize()
+                # WAIT FOR THE END EVENT ONLY
+                ender.synchronize()
                 curr_time = starter.elapsed_time(ender)
-                timings[rep] = curr_time
-        mean_syn = np.sum(timings) / repetitions
-        std_syn = np.std(timings)
-        self.neptune_logger.log_metric("mean_time", mean_syn)
-        self.neptune_logger.log_metric("std_time", std_syn)
+                count += 1
+                delta = curr_time - mean_syn
+                mean_syn += delta / count
+                m2 += delta * (curr_time - mean_syn)
+        std_syn = np.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+        if self.is_main_process:
+            self.neptune_logger.log_metric("mean_time", mean_syn)
+            self.neptune_logger.log_metric("std_time", std_syn)
+
+    def _autocast(self):
+        # the autocast weight cache cannot be used while capturing a CUDA graph
+        return torch.autocast(
+            device_type="cuda" if str(self.device).startswith("cuda") else "cpu",
+            dtype=torch.bfloat16,
+            enabled=self.mixed_precision,
+            cache_enabled=not self.use_cuda_graph,
+        )
+
+    def _critic_step(self, batch, generated=None):
+        self.critic_optimizer.zero_grad(set_to_none=True)
+
+        with self._autocast():
+            if generated is not None:
+                critic_losses = self.gan_model.train_critic(batch, generated)
+            else:
+                critic_losses = self.gan_model.train_critic(batch)
+        critic_total_loss = critic_losses["C/loss"]
+        critic_total_loss.backward()
+
+        self.critic_optimizer.step()
+        return critic_losses
+
+    def _set_static_inputs(self, batch, generated):
+        """
+        Copy the batch and the detached generated sample into the static tensors
+        read by the captured critic graph, allocating them on the first call.
+        Used both before the capture and before every replay.
+        """
+        if self._static_batch is None:
+            self._static_batch = [tensor.clone() for tensor in batch]
+            self._static_generated = generated.clone()
+            return
+        for static_tensor, tensor in zip(self._static_batch, batch):
+            static_tensor.copy_(tensor)
+        self._static_generated.copy_(generated)
+
+    def _capture_critic_step(self, batch, generated):
+        """
+        Run the critic steps of the batch eagerly on a side stream as warmup,
+        then record one critic update into a CUDA graph.
+        The graph only reads the static tensors filled by _set_static_inputs: the
+        critic input is rebuilt from them inside the graph, so no noise is drawn
+        and the per-batch input cache of the gan model is left untouched.
+        """
+        self._set_static_inputs(batch, generated)
+
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.critic_step):
+                critic_losses = self._critic_step(self._static_batch, self._static_generated)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        self.critic_optimizer.zero_grad(set_to_none=True)
+        self._critic_graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._critic_graph):
+            self._static_critic_losses = self._critic_step(
+                self._static_batch, self._static_generated
+            )
+        return critic_losses
+
+    def _accumulate_metrics(self, losses):
+        # keep running sums on the device, so no step waits for a device to host copy
+        for key, value in losses.items():
+            self._metric_sums[key] = self._metric_sums.get(key, 0) + value.detach().float()
+            self._metric_counts[key] = self._metric_counts.get(key, 0) + 1
+
+    def _log_metrics(self):
+        if not self._metric_sums:
+            return
+        keys = list(self._metric_sums)
+        # a single synchronization for all the metrics accumulated since the last call
+        totals = torch.stack([self._metric_sums[key] for key in keys]).cpu()
+        for key, total in zip(keys, totals):
+            self.neptune_logger.log_metric(key, total.item() / self._metric_counts[key])
+        self._metric_sums = {}
+        self._metric_counts = {}
 
     def fit(self, train_loader=None, validation_loader=None, start=0):
         for epoch in tqdm(range(self.max_epoch)):
+            if isinstance(train_loader.sampler, DistributedSampler):
+                train_loader.sampler.set_epoch(epoch)
             for iteration, batch in enumerate(train_loader):
-                for _ in range(self.critic_step):
-                    self.critic_optimizer.zero_grad()
+                batch = [
+                    tensor.to(self.device, non_blocking=True)
+                    for tensor in batch
+                ]
 
-                    critic_losses = self.gan_model.train_critic(batch)
-                    critic_total_loss = critic_losses["C/loss"]
-                    critic_total_loss.backward(retain_graph=True)
+                generated = None
+                if hasattr(self.gan_model, "_build_inputs"):
+                    noized_x, _ = self.gan_model._build_inputs(batch)
+                    with self._autocast(), torch.no_grad():
+                        generated = self.gan_model.generator_model(noized_x)
 
-                    self.critic_optimizer.step()
+                if self.use_cuda_graph and self._critic_graph is None:
+                    critic_losses = self._capture_critic_step(batch, generated)
+                elif (
+                    self._critic_graph is not None
+                    and generated.shape == self._static_generated.shape
+                ):
+                    self._set_static_inputs(batch, generated)
+                    for _ in range(self.critic_step):
+                        self._critic_graph.replay()
+                    critic_losses = self._static_critic_losses
+                else:
+                    # no_sync cannot be used here: every critic step ends with an
+                    # optimizer step that needs the all-reduced gradients
+                    for _ in range(self.critic_step):
+                        critic_losses = self._critic_step(batch, generated)
 
-                self.generator_optimizer.zero_grad()
+                self.generator_optimizer.zero_grad(set_to_none=True)
                 
                 if not self.freeze_generator:
-                    generator_losses = self.gan_model.train_generator(batch)
-                    generator_total_loss = generator_losses["G/loss"]
-                    generator_total_loss.backward(retain_graph=True)
+                    # the critic gradients of the generator loss are dropped by the next
+                    # critic zero_grad, so they are not all-reduced across processes
+                    critic_sync = (
+                        self.gan_model.critic_model.no_sync()
+                        if self.distributed
+                        else contextlib.nullcontext()
+                    )
+                    with critic_sync:
+                        with self._autocast():
+                            generator_losses = self.gan_model.train_generator(batch)
+                        generator_total_loss = generator_losses["G/loss"]
+                        generator_total_loss.backward()
                     self.generator_optimizer.step()
 
-                    for key, value in generator_losses.items():
-                        self.neptune_logger.log_metric(key, value.item())
+                    self._accumulate_metrics(generator_losses)
+
+                self._accumulate_metrics(critic_losses)
 
-                for key, value in critic_losses.items():
-                    self.neptune_logger.log_metric(key, value.item())
+                # both models have run their first forward pass by now
+                if not self._parameters_synchronized:
+                    self._broadcast_parameters()
+                    self._parameters_synchronized = True
 
-                if iteration % self.display_step == 0:
+                if self.is_main_process and iteration % self.display_step == 0:
+                    self._log_metrics()
+                    if torch.cuda.is_available() and str(self.device).startswith("cuda"):
+                        self.neptune_logger.log_metric(
+                            "num_alloc_retries",
+                            torch.cuda.memory_stats(self.device).get("num_alloc_retries", 0),
+                        )
                     name = f"epoch_{epoch}_iter_{iteration}.pt"
                     if not os.path.exists(self.save_path):
                         os.mkdir(self.save_path)
@@ -1 +1 @@
-from .data_utils import get_RICH
\ No newline at end of file
+from .data_utils import get_RICH, float32_collate
\ No newline at end of file
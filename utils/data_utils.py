@@ -7,6 +7,7 @@ from time import time
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import RobustScaler, QuantileTransformer, StandardScaler
 from torch.utils.data import TensorDataset
+from torch.utils.data.dataloader import default_collate
 
 
 def scale_pandas(dataframe, scaler):
@@ -167,6 +168,14 @@ class RichDatasetLoader:
         )
 
 
+def float32_collate(batch):
+    """
+    Collate samples with the default collate function and cast every field to float32,
+    so the training loop only has to move the (pinned) batch to the device.
+    """
+    return [torch.as_tensor(field, dtype=torch.float32) for field in default_collate(batch)]
+
+
 def get_RICH(particle, drop_weights, path):
     flow_shape = (5,)
 